@@ -9,6 +9,9 @@ import xlsxwriter
 import os
 import datetime
 import openpyxl
+import subprocess
+import re
+import numpy as np
 
 from message_ix.utils import make_df
 from message_ix.reporting import Reporter
@@ -334,6 +337,35 @@ def run_baseline():
 
 ### Run New Model
 
+# Inputs already found to be infeasible, keyed by (demand, emission bound, wind percent)
+_infeasible_cache = {}
+
+# ixmp 3.2 lets the GAMS CalledProcessError through; later versions raise ModelError
+_solve_errors = (subprocess.CalledProcessError, getattr(ixmp, 'ModelError', subprocess.CalledProcessError))
+
+def _gams_return_code(error):
+    # CalledProcessError carries the code; ModelError only has it in the message
+    if isinstance(error, subprocess.CalledProcessError):
+        return error.returncode
+    match = re.search(r'return code (\d+):', str(error))
+    if match:
+        return int(match.group(1))
+    return None
+
+def prescreen_inputs(demand_list, emi_percent, wind_percent):
+    # Cheap check for inputs no solve can satisfy. Returns the reason the
+    # inputs are infeasible, or None to pass them to the solver.
+    # The baseline puts no bound on new wind or PV capacity, so a valid
+    # emission bound and wind share always leave a feasible build-out.
+    values = list(demand_list) + [emi_percent, wind_percent]
+    if not np.all(np.isfinite(values)):
+        return 'Inputs must be finite numbers.'
+    if min(demand_list) < 0:
+        return 'Demand cannot be negative.'
+    if emi_percent < 0:
+        return 'Emission bound cannot be negative.'
+    return None
+
 def run_model_from_sheet(filepath, scen_name):
     unit = 'MWa'
     model_horizon = [310, 320, 330, 340, 350]
@@ -349,223 +381,240 @@ def run_model_from_sheet(filepath, scen_name):
     #cap_df = xlsx.parse('Cap Inputs')
     demand_df = xlsx.parse('Population Inputs')
     #storage_df = xlsx.parse('Storage Inputs')
+    emi_percent = xlsx.parse('Emission Bound').iloc[0]['Emission Bound']
+    wind_percent = xlsx.parse('Wind Percent').iloc[0]['Wind Percent']
     
-    # Open model platform
-    mp = ixmp.Platform()
-    
-    # Clone baseline scenario
-    time = datetime.datetime.now()
-    model = 'Westeros Electrified'
-    base = message_ix.Scenario(mp, model=model, scenario='input_baseline')
-    scen = base.clone(model, scen_name, str(time), keep_solution=False)
-    scen.check_out()
-    
-    # Add demand
     pop_list = []
     for index, row in demand_df.iterrows():
         pop_list.append(row[0])
     #print(demand_list)
     demand_list = [i*1000/8760/1000 for i in pop_list] #people x 1000kWh/person / # hours in a year / 1000 to get MWa
     
-    demand_input = pd.Series(demand_list, index=pd.Index(model_horizon, name='Time'))
-    light_demand = pd.DataFrame({
-            'node': country,
-            'commodity': 'light',
-            'level': 'useful',
-            'year': model_horizon,
+    # Skip the solve for inputs known or provably infeasible
+    inputs = (tuple(demand_list), emi_percent, wind_percent)
+    if inputs not in _infeasible_cache:
+        reason = prescreen_inputs(demand_list, emi_percent, wind_percent)
+        if reason is not None:
+            _infeasible_cache[inputs] = reason
+    if inputs in _infeasible_cache:
+        print("Problem is infeasible: " + _infeasible_cache[inputs])
+        return False
+    
+    # Open model platform
+    mp = ixmp.Platform()
+    
+    final_solve = False
+    try:
+        # Clone baseline scenario
+        time = datetime.datetime.now()
+        model = 'Westeros Electrified'
+        base = message_ix.Scenario(mp, model=model, scenario='input_baseline')
+        scen = base.clone(model, scen_name, str(time), keep_solution=False)
+        scen.check_out()
+    
+        # Add demand
+        demand_input = pd.Series(demand_list, index=pd.Index(model_horizon, name='Time'))
+        light_demand = pd.DataFrame({
+                'node': country,
+                'commodity': 'light',
+                'level': 'useful',
+                'year': model_horizon,
+                'time': 'year',
+                'value': demand_input,
+                'unit': unit,
+            })
+        scen.add_par("demand", light_demand)
+    
+        # # Add cost bound
+        # scen.add_par('total_cost', [country, 'all'], value=cost_bound, unit='USD')
+
+        # Add historical activity
+        historic_demand = 0.85 * demand_list[0]
+        historic_generation = historic_demand / grid_efficiency
+
+        base_activity = {
+            'node_loc': country,
+            'year_act': history,
+            'mode': 'standard',
             'time': 'year',
-            'value': demand_input,
             'unit': unit,
-        })
-    scen.add_par("demand", light_demand)
+        }
     
-    # # Add cost bound
-    # scen.add_par('total_cost', [country, 'all'], value=cost_bound, unit='USD')
+        old_activity = {
+            'coal_ppl': 1 * historic_generation,
+            'wind_ppl': 0 * historic_generation,
+            'pv_ppl': 0 * historic_generation
+        }
 
-    # Add historical activity
-    historic_demand = 0.85 * demand_list[0]
-    historic_generation = historic_demand / grid_efficiency
-
-    base_activity = {
-        'node_loc': country,
-        'year_act': history,
-        'mode': 'standard',
-        'time': 'year',
-        'unit': unit,
-    }
-    
-    old_activity = {
-        'coal_ppl': 1 * historic_generation,
-        'wind_ppl': 0 * historic_generation,
-        'pv_ppl': 0 * historic_generation
-    }
-
-    for tec, val in old_activity.items():
-        df = make_df(base_activity, technology=tec, value=val)
-        scen.add_par('historical_activity', df)   
+        for tec, val in old_activity.items():
+            df = make_df(base_activity, technology=tec, value=val)
+            scen.add_par('historical_activity', df)   
         
-    # Add base capacities
-    capacity_factor = {
-        'coal_ppl': 1,
-        'wind_ppl': 0.2,
-        'pv_ppl': 0.15,
-        'bulb': 1, 
-        #'battery': 1
-    }
-    
-    act_to_cap = {
-        'coal_ppl': 1 / 10 / capacity_factor['coal_ppl'] / 2, # 20 year lifetime
-        'wind_ppl': 1 / 10 / capacity_factor['wind_ppl'] / 2,
-        'pv_ppl': 1 / 10 / capacity_factor['pv_ppl']/ 2
-    }
-    
-    base_capacity = {
-        'node_loc': country,
-        'year_vtg': history,
-        'unit': unit,
-    }
+        # Add base capacities
+        capacity_factor = {
+            'coal_ppl': 1,
+            'wind_ppl': 0.2,
+            'pv_ppl': 0.15,
+            'bulb': 1, 
+            #'battery': 1
+        }
+    
+        act_to_cap = {
+            'coal_ppl': 1 / 10 / capacity_factor['coal_ppl'] / 2, # 20 year lifetime
+            'wind_ppl': 1 / 10 / capacity_factor['wind_ppl'] / 2,
+            'pv_ppl': 1 / 10 / capacity_factor['pv_ppl']/ 2
+        }
+    
+        base_capacity = {
+            'node_loc': country,
+            'year_vtg': history,
+            'unit': unit,
+        }
 
 
-    for tec in act_to_cap:
-        value = old_activity[tec] * act_to_cap[tec]
-        df = make_df(base_capacity, technology=tec, value=value)
-        scen.add_par('historical_new_capacity', df)
+        for tec in act_to_cap:
+            value = old_activity[tec] * act_to_cap[tec]
+            df = make_df(base_capacity, technology=tec, value=value)
+            scen.add_par('historical_new_capacity', df)
         
-    # Add activity lower bounds
-    # coal_percent = cap_df.loc[cap_df['Technology'] == 'coal_ppl', 'Capacity'].iloc[0]
-    # wind_percent = cap_df.loc[cap_df['Technology'] == 'wind_ppl', 'Capacity'].iloc[0]
-    # pv_percent = cap_df.loc[cap_df['Technology'] == 'pv_ppl', 'Capacity'].iloc[0]
+        # Add activity lower bounds
+        # coal_percent = cap_df.loc[cap_df['Technology'] == 'coal_ppl', 'Capacity'].iloc[0]
+        # wind_percent = cap_df.loc[cap_df['Technology'] == 'wind_ppl', 'Capacity'].iloc[0]
+        # pv_percent = cap_df.loc[cap_df['Technology'] == 'pv_ppl', 'Capacity'].iloc[0]
    
-    # Total energy share
-    # share_coal = 'share_coal'
-    # share_wind = 'share_wind'
-    # share_pv = 'share_pv'
-    # scen.add_set('shares', share_coal)
-    # scen.add_set('shares', share_wind)
-    # scen.add_set('shares', share_pv)
+        # Total energy share
+        # share_coal = 'share_coal'
+        # share_wind = 'share_wind'
+        # share_pv = 'share_pv'
+        # scen.add_set('shares', share_coal)
+        # scen.add_set('shares', share_wind)
+        # scen.add_set('shares', share_pv)
     
         
-    # Add emission bound
-    scen.commit('Solving BAU')
-    scen.solve()
-    rep = Reporter.from_scenario(scen)
-    emi_key = rep.full_key('emi').drop('h', 'yv')
-    act_key = rep.full_key('ACT').drop('h', 'yv')
-    emi = rep.get(emi_key).to_dataframe()
-    act = rep.get(act_key).to_dataframe()
-    bau_emi = emi.to_numpy().sum()
-    scen.remove_solution()
-    
-    #historic_emi = old_activity['coal_ppl']*7.4*30
-    #emi_bound = xlsx.parse('Emission Bound').iloc[0]['Emission Bound']/100*historic_emi
-    emi_bound = xlsx.parse('Emission Bound').iloc[0]['Emission Bound']/100 * bau_emi / 5
-    
-    #DEBUG
-    emi_df = pd.DataFrame(data={'Emission Limit': [emi_bound], 'BAU': [bau_emi]})
-    write_file(filepath, emi_df, 'Emission Limit')
-    write_file(filepath, emi, 'BAU Emissions')
-    write_file(filepath, act, 'BAU Activity')
-    
-    scen.check_out()
-    scen.add_par('bound_emission', [country, 'GHG', 'all', 'cumulative'], value = emi_bound, unit='MtCO2')
-
-    # Add renewable energy shares
-    wind_max = xlsx.parse('Wind Percent').iloc[0]['Wind Percent']/100
-    shares = 'share_wind_electricity'
-    scen.add_set('shares', shares)
-    
-    # Define renewable share
-    type_tec = 'electricity_renewable'
-    scen.add_cat('technology', type_tec, 'wind_ppl')
-    scen.add_cat('technology', type_tec, 'pv_ppl')
-    df = pd.DataFrame({'shares': [shares],
-                   'node_share': country,
-                   'node': country,
-                   'type_tec': type_tec,
-                   'mode': 'standard',
-                   'commodity': 'electricity',
-                   'level': 'secondary',
-    })
-    scen.add_set('map_shares_commodity_total', df)
-    
-    # Define wind share (of renewable)
-    type_tec = 'electricity_wind'
-    scen.add_cat('technology', type_tec, 'wind_ppl')
-    df = pd.DataFrame({'shares': [shares],
-                   'node_share': country,
-                   'node': country,
-                   'type_tec': type_tec,
-                   'mode': 'standard',
-                   'commodity': 'electricity',
-                   'level': 'secondary',
+        # Add emission bound
+        scen.commit('Solving BAU')
+        scen.solve()
+        rep = Reporter.from_scenario(scen)
+        emi_key = rep.full_key('emi').drop('h', 'yv')
+        act_key = rep.full_key('ACT').drop('h', 'yv')
+        emi = rep.get(emi_key).to_dataframe()
+        act = rep.get(act_key).to_dataframe()
+        bau_emi = emi.to_numpy().sum()
+        scen.remove_solution()
+    
+        #historic_emi = old_activity['coal_ppl']*7.4*30
+        #emi_bound = xlsx.parse('Emission Bound').iloc[0]['Emission Bound']/100*historic_emi
+        emi_bound = emi_percent/100 * bau_emi / 5
+    
+        #DEBUG
+        emi_df = pd.DataFrame(data={'Emission Limit': [emi_bound], 'BAU': [bau_emi]})
+        write_file(filepath, emi_df, 'Emission Limit')
+        write_file(filepath, emi, 'BAU Emissions')
+        write_file(filepath, act, 'BAU Activity')
+    
+        scen.check_out()
+        scen.add_par('bound_emission', [country, 'GHG', 'all', 'cumulative'], value = emi_bound, unit='MtCO2')
+
+        # Add renewable energy shares
+        wind_max = wind_percent/100
+        shares = 'share_wind_electricity'
+        scen.add_set('shares', shares)
+    
+        # Define renewable share
+        type_tec = 'electricity_renewable'
+        scen.add_cat('technology', type_tec, 'wind_ppl')
+        scen.add_cat('technology', type_tec, 'pv_ppl')
+        df = pd.DataFrame({'shares': [shares],
+                       'node_share': country,
+                       'node': country,
+                       'type_tec': type_tec,
+                       'mode': 'standard',
+                       'commodity': 'electricity',
+                       'level': 'secondary',
         })
-    scen.add_set('map_shares_commodity_share', df)
-    
-    # Set as upper bound
-    df = pd.DataFrame({'shares': shares,
-                   'node_share': country,
-                   'year_act': [310],
-                   'time': 'year',
-                   'value': [wind_max],
-                   'unit': '-'})
-    scen.add_par('share_commodity_up', df)
-    
-    df = pd.DataFrame({'shares': shares,
-                   'node_share': country,
-                   'year_act': [320],
-                   'time': 'year',
-                   'value': [wind_max],
-                   'unit': '-'})
-    scen.add_par('share_commodity_up', df)
-    
-    df = pd.DataFrame({'shares': shares,
-                   'node_share': country,
-                   'year_act': [330],
-                   'time': 'year',
-                   'value': [wind_max],
-                   'unit': '-'})
-    scen.add_par('share_commodity_up', df)
-    
-    df = pd.DataFrame({'shares': shares,
-                   'node_share': country,
-                   'year_act': [340],
-                   'time': 'year',
-                   'value': [wind_max],
-                   'unit': '-'})
-    scen.add_par('share_commodity_up', df)
-    
-    df = pd.DataFrame({'shares': shares,
-                   'node_share': country,
-                   'year_act': [350],
-                   'time': 'year',
-                   'value': [wind_max],
-                   'unit': '-'})
-    scen.add_par('share_commodity_up', df)
-    
-    # Solve scenario
-    #scen.to_excel(os.getcwd() + '/Data Sheets/' + scen_name + ' Parameters.xlsx')
-    scen.commit('Solving ' + scen_name)
-    
-    # DEBUG SECTION
-    scen.solve()
-        
-    # Save Results
-    save_results(scen, filepath)
-    
-    mp.close_db()
-    
-    # Catch infeasibility errors
-#     try:
-#         scen.solve()
+        scen.add_set('map_shares_commodity_total', df)
+    
+        # Define wind share (of renewable)
+        type_tec = 'electricity_wind'
+        scen.add_cat('technology', type_tec, 'wind_ppl')
+        df = pd.DataFrame({'shares': [shares],
+                       'node_share': country,
+                       'node': country,
+                       'type_tec': type_tec,
+                       'mode': 'standard',
+                       'commodity': 'electricity',
+                       'level': 'secondary',
+            })
+        scen.add_set('map_shares_commodity_share', df)
+    
+        # Set as upper bound
+        df = pd.DataFrame({'shares': shares,
+                       'node_share': country,
+                       'year_act': [310],
+                       'time': 'year',
+                       'value': [wind_max],
+                       'unit': '-'})
+        scen.add_par('share_commodity_up', df)
+    
+        df = pd.DataFrame({'shares': shares,
+                       'node_share': country,
+                       'year_act': [320],
+                       'time': 'year',
+                       'value': [wind_max],
+                       'unit': '-'})
+        scen.add_par('share_commodity_up', df)
+    
+        df = pd.DataFrame({'shares': shares,
+                       'node_share': country,
+                       'year_act': [330],
+                       'time': 'year',
+                       'value': [wind_max],
+                       'unit': '-'})
+        scen.add_par('share_commodity_up', df)
+    
+        df = pd.DataFrame({'shares': shares,
+                       'node_share': country,
+                       'year_act': [340],
+                       'time': 'year',
+                       'value': [wind_max],
+                       'unit': '-'})
+        scen.add_par('share_commodity_up', df)
+    
+        df = pd.DataFrame({'shares': shares,
+                       'node_share': country,
+                       'year_act': [350],
+                       'time': 'year',
+                       'value': [wind_max],
+                       'unit': '-'})
+        scen.add_par('share_commodity_up', df)
+    
+        # Solve scenario
+        #scen.to_excel(os.getcwd() + '/Data Sheets/' + scen_name + ' Parameters.xlsx')
+        scen.commit('Solving ' + scen_name)
+        final_solve = True
+        scen.solve()
         
-#         # Save Results
-#         save_results(scen, filepath)
-#         #make_plots(scen, filepath)
+        # Save Results
+        save_results(scen, filepath)
+        #make_plots(scen, filepath)
         
-#     except: 
-#         print("Problem is infeasible.")
-#     finally:
-#         mp.close_db()
+    # Catch infeasibility errors
+    except _solve_errors as e:
+        # MESSAGE aborts with a GAMS execution error (return code 3) when it
+        # finds no optimal solution; other codes are licence or setup failures
+        if _gams_return_code(e) != 3:
+            print("Solve failed: " + str(e))
+            return False
+        if final_solve:
+            _infeasible_cache[inputs] = 'No solution satisfies the emission bound and wind share.'
+        else:
+            _infeasible_cache[inputs] = 'No solution meets the demand, even without the emission bound.'
+        print("Problem is infeasible: " + _infeasible_cache[inputs])
+        return False
+    finally:
+        mp.close_db()
+    
+    return True
 
 
 # ### Link to Interface and Save Results
@@ -666,7 +715,8 @@ def process_inputs(app):
     write_file(fp, df, 'Wind Percent')
     
     # Rerun model from spreadsheet
-    run_model_from_sheet(fp, scen_name)
+    if not run_model_from_sheet(fp, scen_name):
+        return None
 
     # Read from saved spreadsheet
     xlsx = pd.ExcelFile(fp)
@@ -685,4 +735,76 @@ def process_inputs(app):
     cost = xlsx.parse('Total Cost').iloc[0]['Cost']
     emissions = xlsx.parse('Total Emissions').iloc[0]['Emissions']
     
-    return cost, emissions, sheet_dict, scen_name
\ No newline at end of file
+    return cost, emissions, sheet_dict, scen_name
+
+
+### Comparison History
+
+class ScenarioHistory:
+    # Columnar store of comparison results, one row per solved scenario.
+    # Values live in preallocated numpy arrays that double in size when full,
+    # so appending a scenario costs the same however long the history is.
+    years = [310, 320, 330, 340, 350]
+    technologies = ['coal_ppl', 'wind_ppl', 'pv_ppl']
+
+    def __init__(self, capacity=64):
+        self._initial_capacity = capacity
+        self.clear()
+
+    def __len__(self):
+        return self._size
+
+    def clear(self):
+        n = self._initial_capacity
+        self._size = 0
+        self._names = []
+        self._cost = np.empty(n)
+        self._emissions = np.empty(n)
+        self._population = np.empty((n, 2))
+        self._cap = np.empty((n, len(self.technologies), len(self.years)))
+
+    def _grow(self):
+        n = 2 * len(self._cost)
+        for attr in ['_cost', '_emissions', '_population', '_cap']:
+            old = getattr(self, attr)
+            new = np.empty((n,) + old.shape[1:])
+            new[:self._size] = old[:self._size]
+            setattr(self, attr, new)
+
+    def append(self, name, cost, emissions, population, capacities):
+        # capacities: one per-year list for each entry in technologies
+        if self._size == len(self._cost):
+            self._grow()
+        i = self._size
+        self._names.append(name)
+        self._cost[i] = cost
+        self._emissions[i] = emissions
+        self._population[i] = population
+        self._cap[i] = capacities
+        self._size = i + 1
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def cost(self):
+        return self._cost[:self._size]
+
+    @property
+    def emissions(self):
+        return self._emissions[:self._size]
+
+    def page(self, start, stop):
+        # Build the comparison table for rows [start, stop) only
+        stop = min(stop, self._size)
+        rows = range(start, stop)
+        data = {
+            'Population [310-350]': [self._population[i].astype(int).tolist() for i in rows],
+            'Cost [USD]': self._cost[start:stop],
+            'Emissions [MtCO2]': self._emissions[start:stop],
+            'Coal Capacity By Year [MWa]': [self._cap[i, 0].tolist() for i in rows],
+            'Wind Capacity By Year [MWa]': [self._cap[i, 1].tolist() for i in rows],
+            'PV Capacity By Year [MWa]': [self._cap[i, 2].tolist() for i in rows]
+        }
+        return pd.DataFrame(data=data, index=self._names[start:stop])